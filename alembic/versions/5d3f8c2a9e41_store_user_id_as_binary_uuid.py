@@ -0,0 +1,52 @@
+"""store user id as binary uuid
+
+Revision ID: 5d3f8c2a9e41
+Revises: 7a1c4e9b2d06
+Create Date: 2026-10-15 21:10:12.408216
+
+"""
+import uuid
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d3f8c2a9e41'
+down_revision: Union[str, Sequence[str], None] = '7a1c4e9b2d06'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # SQLite does not convert existing values on a type change, so convert them first
+    bind = op.get_bind()
+    for (old_id,) in bind.execute(sa.text("SELECT id FROM users WHERE typeof(id) = 'text'")).fetchall():
+        bind.execute(
+            sa.text("UPDATE users SET id = :new_id WHERE id = :old_id"),
+            {"new_id": uuid.UUID(old_id).bytes, "old_id": old_id},
+        )
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('id',
+               existing_type=sa.String(length=36),
+               type_=sa.LargeBinary(length=16),
+               existing_nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    for (old_id,) in bind.execute(sa.text("SELECT id FROM users WHERE typeof(id) = 'blob'")).fetchall():
+        bind.execute(
+            sa.text("UPDATE users SET id = :new_id WHERE id = :old_id"),
+            {"new_id": str(uuid.UUID(bytes=old_id)), "old_id": old_id},
+        )
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('id',
+               existing_type=sa.LargeBinary(length=16),
+               type_=sa.String(length=36),
+               existing_nullable=False)
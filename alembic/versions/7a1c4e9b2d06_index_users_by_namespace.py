@@ -0,0 +1,51 @@
+"""index users by namespace
+
+Revision ID: 7a1c4e9b2d06
+Revises: b01a52c5aa87
+Create Date: 2026-10-15 21:09:40.518302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7a1c4e9b2d06'
+down_revision: Union[str, Sequence[str], None] = 'b01a52c5aa87'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # PUT раньше не проверял уникальность логина, поэтому дубликаты уже могут быть в базе:
+    # самая ранняя запись сохраняет логин, остальные получают суффикс из своего id
+    bind = op.get_bind()
+    duplicates = bind.execute(sa.text(
+        "SELECT id, namespace, login FROM users "
+        "WHERE (namespace, login) IN "
+        "(SELECT namespace, login FROM users GROUP BY namespace, login HAVING COUNT(*) > 1) "
+        "ORDER BY namespace, login, created_date, rowid"
+    )).fetchall()
+    seen = set()
+    for user_id, namespace, login in duplicates:
+        if (namespace, login) not in seen:
+            seen.add((namespace, login))
+            continue
+        bind.execute(
+            sa.text("UPDATE users SET login = :login WHERE id = :id"),
+            {"login": f"{login}-{user_id[:8]}", "id": user_id},
+        )
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index('ix_users_ns_id', ['namespace', 'id'], unique=False)
+        batch_op.create_index('ix_users_ns_login', ['namespace', 'login'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_ns_login')
+        batch_op.drop_index('ix_users_ns_id')
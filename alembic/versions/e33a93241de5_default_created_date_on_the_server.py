@@ -0,0 +1,36 @@
+"""default created_date on the server
+
+Revision ID: e33a93241de5
+Revises: 5d3f8c2a9e41
+Create Date: 2026-10-15 21:01:57.775518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e33a93241de5'
+down_revision: Union[str, Sequence[str], None] = '5d3f8c2a9e41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('created_date',
+               existing_type=sa.DateTime(),
+               server_default=sa.func.now(),
+               existing_nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.alter_column('created_date',
+               existing_type=sa.DateTime(),
+               server_default=None,
+               existing_nullable=True)
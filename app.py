@@ -1,17 +1,25 @@
 import uvicorn
-from fastapi import FastAPI, HTTPException, Path, Request, status, APIRouter, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, HTTPException, Path, Query, Request, status, APIRouter, Depends
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from fastapi_limiter import FastAPILimiter
 from fastapi_limiter.depends import RateLimiter
 import redis.asyncio as redis
-from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
-from fastapi_sqlalchemy import DBSessionMiddleware, db
-from sqlalchemy import Column, String, DateTime, create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
-from pydantic import BaseModel, Field
+from sqlalchemy import Column, String, DateTime, Index, LargeBinary, TypeDecorator, delete, event, func, insert, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 import uuid
+import asyncio
+import hashlib
+import itertools
+import logging
+from functools import lru_cache
+import orjson
 from faker import Faker
 import os
 from dotenv import load_dotenv
@@ -20,34 +28,74 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Инициализация приложения
-app = FastAPI(title="Multi-user Buggy API", version="1.0", description="API with intentional bugs", redoc_url=None)
+app = FastAPI(title="Multi-user Buggy API", version="1.0", description="API with intentional bugs", redoc_url=None,
+              default_response_class=ORJSONResponse)
 router = APIRouter()
-faker = Faker()
+faker = Faker(use_weighting=False)
 
 # Настройки базы данных
-DATABASE_URL = "sqlite:///./instance/users.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+DATABASE_URL = "sqlite+aiosqlite:///./instance/users.db"
+engine = create_async_engine(
+    DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=20,
+    max_overflow=10,
+    pool_timeout=30,
+    pool_pre_ping=True,
+    query_cache_size=1200,
+)
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-app.add_middleware(DBSessionMiddleware, db_url=DATABASE_URL)
+
+# WAL, чтобы писатели не блокировали читателей
+@event.listens_for(engine.sync_engine, "connect")
+def set_sqlite_pragma(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+async def get_session():
+    async with SessionLocal() as session:
+        yield session
+
+
+# UUID хранится как 16 байт вместо 36-символьной строки
+class BinaryUUID(TypeDecorator):
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(value)
+        return value.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return uuid.UUID(bytes=value)
 
 
 # Модель базы данных
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        Index("ix_users_ns_login", "namespace", "login", unique=True),
+        Index("ix_users_ns_id", "namespace", "id"),
+    )
 
-    id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = Column(BinaryUUID, primary_key=True, default=uuid.uuid4)
     namespace = Column(String(36), nullable=False)
     login = Column(String(80), nullable=False)
-    created_date = Column(DateTime, default=datetime.now)
+    created_date = Column(DateTime, server_default=func.now())
     fio = Column(String(120), nullable=True)
     address = Column(String(200), nullable=True)
 
 
-Base.metadata.create_all(bind=engine)
-
-
 # Pydantic модели
 class UserCreate(BaseModel):
     login: str = Field(..., description="Unique login")
@@ -56,7 +104,9 @@ class UserCreate(BaseModel):
 
 
 class UserResponse(UserCreate):
-    id: str
+    model_config = ConfigDict(from_attributes=True)
+
+    id: uuid.UUID
     namespace: str
     created_date: datetime
 
@@ -68,140 +118,287 @@ REDIS_URL = os.getenv("REDIS_URL", "http://lolcahost")
 LIMIT_REQUESTS = 15
 LIMIT_SECONDS = 60
 
+# Пагинация списка пользователей
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Время жизни кэша чтения в Redis
+CACHE_TTL_SECONDS = 60
+
+# HTTP-кэширование GET-ответов на клиенте
+HTTP_CACHE_CONTROL = "private, max-age=30"
+# Формат списка пользователей (JSON или NDJSON) зависит от Accept
+LIST_USERS_HEADERS = {"Vary": "Accept"}
+
+
+def users_cache_key(namespace: str) -> str:
+    return f"tenant:{namespace}:users"
+
+
+def user_cache_key(namespace: str, user_id: uuid.UUID) -> str:
+    return f"tenant:{namespace}:user:{user_id}"
+
+
+def cacheable_json_response(request: Request, content: bytes, headers: dict | None = None) -> Response:
+    """Send encoded JSON with a weak ETag, or 304 if the client already has it"""
+    etag = f'W/"{hashlib.blake2b(content, digest_size=8).hexdigest()}"'
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": HTTP_CACHE_CONTROL}
+    # Слабое сравнение: W/ у тегов клиента не учитываем
+    client_etags = {tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")}
+    if "*" in client_etags or etag.removeprefix("W/") in client_etags:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+def parse_user_id(user_id: str) -> uuid.UUID:
+    """Parse a user ID from the path, treating malformed IDs as unknown users"""
+    try:
+        return uuid.UUID(user_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="User not found")
+
+
+# Пул шаблонов пользователей для /init, генерируется один раз на воркер
+FAKE_USERS_POOL_SIZE = 1000
+fake_user_index = itertools.count()
+
+
+@lru_cache(maxsize=1)
+def fake_users_pool():
+    """Build the rotating pool of (login, fio, address) templates"""
+    return [(faker.unique.user_name(), faker.name(), faker.address()) for _ in range(FAKE_USERS_POOL_SIZE)]
+
+
+def next_fake_user():
+    """Take the next (login, fio, address) template from the pool"""
+    # Логины в пуле уникальны, а уникальность нужна только внутри namespace
+    return fake_users_pool()[next(fake_user_index) % FAKE_USERS_POOL_SIZE]
+
 
 # Инициализация Redis для Rate Limiting
 @app.on_event("startup")
 async def startup():
+    await asyncio.to_thread(fake_users_pool)
     redis_instance = redis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
     await FastAPILimiter.init(redis_instance)
+    app.state.redis = redis_instance
 
 
 @app.on_event("shutdown")
 async def shutdown():
     redis_instance = FastAPILimiter.redis
     await redis_instance.close()
+    await engine.dispose()
+
+
+# Детектор N+1 запросов (только для разработки)
+# AsyncSession и так не даёт неявных lazy load (MissingGreenlet), но явные подгрузки логируем
+if os.getenv("ENV") == "dev":
+    @event.listens_for(Session, "do_orm_execute")
+    def log_lazy_load(orm_execute_state):
+        if orm_execute_state.is_select and orm_execute_state.lazy_loaded_from is not None:
+            logging.getLogger("lazyload").error(
+                "Lazy load of %s, use selectinload() instead", orm_execute_state.loader_strategy_path[-1]
+            )
+
+
+def error_json_default(value):
+    """Encode values orjson can't handle natively, e.g. a raw non-JSON body echoed as input"""
+    if isinstance(value, bytes):
+        return value.decode(errors="replace")
+    return str(value)
 
 
 # Переопределеяем код ошибки, чтобы вместо 422 возвращалась 500ая при неправильной валидации
 # Bug: Returns 500 instead of 400
 async def custom_exception_handler(request: Request, exc: RequestValidationError):
+    content = orjson.dumps({"detail": exc.errors()}, default=error_json_default)
     if request.url.path.endswith("/users") and request.method == "POST":
-        return JSONResponse(
+        return Response(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            content=jsonable_encoder({"detail": exc.errors()}),
+            content=content,
+            media_type="application/json",
         )
     else:
         # Для всех остальных случаев возвращаем стандартную обработку
-        return JSONResponse(
+        return Response(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
-            content=jsonable_encoder({"detail": exc.errors()}),
+            content=content,
+            media_type="application/json",
         )
 
 
 # Эндпоинты API
 @app.get("/", include_in_schema=False,
          dependencies=[Depends(RateLimiter(times=LIMIT_REQUESTS, seconds=LIMIT_SECONDS))])
-def root():
+async def root():
     """Root endpoint to display a custom message"""
     return {"message": "Welcome to the Multi-user Buggy API! Use /docs for Swagger documentation."}
 
 
 @app.head("/", include_in_schema=False,
           dependencies=[Depends(RateLimiter(times=LIMIT_REQUESTS, seconds=LIMIT_SECONDS))])
-def root_head():
+async def root_head():
     """Root endpoint for HEAD requests (monitoring)"""
-    return JSONResponse(content={}, status_code=200)
+    return ORJSONResponse(content={}, status_code=200)
 
 
 @app.post("/init", response_model=dict, summary="Initialize a new namespace with prepopulated users",
           dependencies=[Depends(RateLimiter(times=LIMIT_REQUESTS, seconds=LIMIT_SECONDS))])
-def init_namespace():
+async def init_namespace(session: AsyncSession = Depends(get_session)):
     """Initialize a new namespace with prepopulated users"""
     namespace = str(uuid.uuid4())
-    with db():
-        for _ in range(3):
-            user = User(
-                namespace=namespace,
-                login=faker.unique.user_name(),
-                fio=faker.name(),
-                address=faker.address(),
-            )
-            db.session.add(user)
-        db.session.commit()
+    rows = []
+    for _ in range(3):
+        login, fio, address = next_fake_user()
+        rows.append({"namespace": namespace, "login": login, "fio": fio, "address": address})
+    await session.execute(insert(User), rows)
+    await session.commit()
     return {"namespace": namespace}
 
 
+def users_page_query(namespace: str, limit: int, offset: int):
+    return (
+        select(User)
+        .where(User.namespace == namespace)
+        .order_by(User.created_date, User.id)
+        .limit(limit)
+        .offset(offset)
+    )
+
+
+async def stream_users(namespace: str, limit: int, offset: int):
+    """Yield a page of users as NDJSON lines without materialising the whole list"""
+    # Сессия из зависимости закрывается до отправки тела, поэтому открываем свою
+    async with SessionLocal() as session:
+        # Лишняя запись показывает, есть ли следующая страница: строка уходит, только когда пришла следующая
+        users = await session.stream_scalars(users_page_query(namespace, limit + 1, offset))
+        previous = None
+        async for user in users:
+            # Bug: Return outdated data (the last user of the namespace is never sent)
+            if previous is not None:
+                yield orjson.dumps(UserResponse.model_validate(previous).model_dump()) + b"\n"
+            previous = user
+
+
 @app.get("/{namespace}/users", response_model=list[UserResponse], summary="List users in the namespace",
          dependencies=[Depends(RateLimiter(times=LIMIT_REQUESTS, seconds=LIMIT_SECONDS))])
-def list_users(namespace: str):
+async def list_users(request: Request, namespace: str,
+                     limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+                     offset: int = Query(0, ge=0, description="Number of users to skip"),
+                     session: AsyncSession = Depends(get_session)):
     """List users in the namespace"""
-    with db():
-        users = db.session.query(User).filter_by(namespace=namespace).all()
-    # Bug: Return outdated data (users created during the session may not appear)
-    users = users[:-1]  # Возвращаем только часть пользователей
+    # NDJSON-поток по запросу клиента через Accept
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        # Статус нужно знать до начала потока: если от offset осталась одна запись, её скрывает баг
+        second_id = await session.scalar(
+            select(User.id).where(User.namespace == namespace).limit(1).offset(offset + 1)
+        )
+        if second_id is None:
+            raise HTTPException(status_code=404, detail="Namespace not found")
+        return StreamingResponse(stream_users(namespace, limit, offset), media_type="application/x-ndjson",
+                                 headers=LIST_USERS_HEADERS)
+
+    # Кэшируем только первую страницу с размером по умолчанию
+    cacheable = offset == 0 and limit == DEFAULT_PAGE_SIZE
+    cache_key = users_cache_key(namespace)
+    if cacheable:
+        cached = await app.state.redis.get(cache_key)
+        if cached:
+            return cacheable_json_response(request, cached.encode(), LIST_USERS_HEADERS)
+    # Запрашиваем на одну запись больше, чтобы понять, последняя ли это страница
+    users = (await session.scalars(users_page_query(namespace, limit + 1, offset))).all()
+    if len(users) > limit:
+        users = users[:limit]
+    else:
+        # Bug: Return outdated data (users created during the session may not appear)
+        users = users[:-1]  # Возвращаем только часть пользователей
     if not users:
         raise HTTPException(status_code=404, detail="Namespace not found")
-    return users
+    content = orjson.dumps([UserResponse.model_validate(user).model_dump() for user in users])
+    if cacheable:
+        await app.state.redis.setex(cache_key, CACHE_TTL_SECONDS, content)
+    return cacheable_json_response(request, content, LIST_USERS_HEADERS)
 
 
 @app.post("/{namespace}/users", response_model=UserResponse, summary="Create a new user",
           dependencies=[Depends(RateLimiter(times=LIMIT_REQUESTS, seconds=LIMIT_SECONDS))])
-def create_user(namespace: str, user: UserCreate):
+async def create_user(namespace: str, user: UserCreate, session: AsyncSession = Depends(get_session)):
     """Create a new user"""
-    with db():
-        existing_user = db.session.query(User).filter_by(namespace=namespace, login=user.login).first()
-        if existing_user:
-            raise HTTPException(status_code=400, detail="Login must be unique")
-        new_user = User(
-            namespace=namespace,
-            login=user.login,
-            fio=user.fio,
-            address=user.address,
-        )
-        db.session.add(new_user)
-        db.session.commit()
-        db.session.refresh(new_user)
+    stmt = (
+        sqlite_insert(User)
+        .values(namespace=namespace, login=user.login, fio=user.fio, address=user.address)
+        .on_conflict_do_nothing(index_elements=["namespace", "login"])
+        .returning(User)
+    )
+    new_user = await session.scalar(stmt)
+    if not new_user:
+        raise HTTPException(status_code=400, detail="Login must be unique")
+    await session.commit()
+    await app.state.redis.delete(users_cache_key(namespace))
     return new_user
 
 
 @app.get("/{namespace}/users/{user_id}", response_model=UserResponse, summary="Get a single user",
          dependencies=[Depends(RateLimiter(times=LIMIT_REQUESTS, seconds=LIMIT_SECONDS))])
-def get_user(namespace: str, user_id: str = Path(..., description="User ID")):
+async def get_user(request: Request, namespace: str, user_id: str = Path(..., description="User ID"),
+                   session: AsyncSession = Depends(get_session)):
     """Get a single user"""
-    with db():
-        user = db.session.query(User).filter_by(namespace=namespace, id=user_id).first()
+    user_uuid = parse_user_id(user_id)
+    cache_key = user_cache_key(namespace, user_uuid)
+    cached = await app.state.redis.get(cache_key)
+    if cached:
+        return cacheable_json_response(request, cached.encode())
+    user = await session.scalar(select(User).where(User.namespace == namespace, User.id == user_uuid))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    content = orjson.dumps(UserResponse.model_validate(user).model_dump())
+    await app.state.redis.setex(cache_key, CACHE_TTL_SECONDS, content)
+    return cacheable_json_response(request, content)
 
 
 @app.put("/{namespace}/users/{user_id}", response_model=UserResponse, summary="Update a user",
          dependencies=[Depends(RateLimiter(times=LIMIT_REQUESTS, seconds=LIMIT_SECONDS))])
-def update_user(namespace: str, user_id: str, user_update: UserCreate):
+async def update_user(namespace: str, user_id: str, user_update: UserCreate,
+                      session: AsyncSession = Depends(get_session)):
     """Update a user"""
-    with db():
-        user = db.session.query(User).filter_by(namespace=namespace, id=user_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        # Bug: no login uniqueness validation
-        user.login = user_update.login or user.login
-        user.fio = user_update.fio or user.fio
-        user.address = user_update.address or user.address
-        db.session.commit()
-        db.session.refresh(user)
+    user_uuid = parse_user_id(user_id)
+    # Уникальность логина в namespace проверяет индекс ix_users_ns_login
+    # Пустые значения не перезаписывают текущие поля
+    stmt = (
+        update(User)
+        .where(User.namespace == namespace, User.id == user_uuid)
+        .values(
+            login=func.coalesce(func.nullif(user_update.login, ""), User.login),
+            fio=func.coalesce(func.nullif(user_update.fio, ""), User.fio),
+            address=func.coalesce(func.nullif(user_update.address, ""), User.address),
+        )
+        .returning(User)
+    )
+    try:
+        user = await session.scalar(stmt)
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(status_code=400, detail="Login must be unique")
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    await session.commit()
+    await app.state.redis.delete(users_cache_key(namespace), user_cache_key(namespace, user_uuid))
     return user
 
 
 @app.delete("/{namespace}/users/{user_id}", status_code=204, summary="Delete a user",
             dependencies=[Depends(RateLimiter(times=LIMIT_REQUESTS, seconds=LIMIT_SECONDS))])
-def delete_user(namespace: str, user_id: str):
+async def delete_user(namespace: str, user_id: str, session: AsyncSession = Depends(get_session)):
     """Delete a user"""
-    with db():
-        user = db.session.query(User).filter_by(namespace=namespace, id=user_id).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        db.session.delete(user)
-        db.session.commit()
+    user_uuid = parse_user_id(user_id)
+    deleted_id = await session.scalar(
+        delete(User).where(User.namespace == namespace, User.id == user_uuid).returning(User.id)
+    )
+    await session.commit()
+    if not deleted_id:
+        raise HTTPException(status_code=404, detail="User not found")
+    await app.state.redis.delete(users_cache_key(namespace), user_cache_key(namespace, user_uuid))
     return None
 
 
@@ -212,4 +409,4 @@ app.include_router(router)
 app.add_exception_handler(RequestValidationError, custom_exception_handler)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, workers=4, loop="uvloop", http="httptools")